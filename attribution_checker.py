@@ -1,50 +1,254 @@
 import logging
+import os
+import re
 import json
 import csv
 from datetime import datetime
+from functools import partial
+from urllib.parse import urlsplit, urlunsplit
 import argparse
+from collections import OrderedDict
+import atexit
+import itertools
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import TimeoutException
 
 logging.basicConfig(level=logging.INFO)
 
+# Patterns are matched against lowercased text, so they are stored lowercased.
+
+# Patterns to check for library presence
+_LIBRARY_PATTERNS = {
+    'Leaflet': ('leaflet.js', 'l.map(', 'l.tilelayer('),
+    'OpenLayers': ('ol.js', 'ol.map', 'new ol.map')
+}
+
+# Script file names that identify each library
+_LIBRARY_SCRIPT_PATTERNS = {
+    library: (library.lower() + '.js', library.lower() + '.min.js')
+    for library in _LIBRARY_PATTERNS
+}
+
+# Patterns to check for MapTiler usage
+_MAPTILER_PATTERNS = (
+    'maptiler.com',
+    'maptiler-cdn',
+    'maptiler-server',
+    'maptiler.org'
+)
+
+# All MapTiler patterns share the 'maptiler' prefix, which lets the regex
+# engine skip ahead with a literal search; one finditer pass over the page
+# source beats a separate substring scan per pattern.
+_MAPTILER_RE = re.compile('|'.join(re.escape(pattern) for pattern in _MAPTILER_PATTERNS))
+
+# MapTiler references almost always sit in <head> or the first scripts of a
+# page, so the source scan covers this many characters first and only reads
+# the rest of a large document when the head has no match.
+_SOURCE_HEAD_SIZE = 256 * 1024
+
+# Attribution substrings. Every accepted variant ('© MapTiler', 'MapTiler Cloud',
+# 'OpenStreetMap contributors', ...) contains one of these, so a single
+# substring test per provider is enough.
+_MAPTILER_ATTRIBUTION = 'maptiler'
+_OSM_ATTRIBUTION = 'openstreetmap'
+
+# Chrome switches for services the checker never uses
+_CHROME_DISABLED_FEATURES = (
+    '--disable-extensions',
+    '--disable-background-networking',
+    '--disable-sync',
+    '--disable-translate',
+    '--disable-features=TranslateUI'
+)
+
+# Resources blocked in every page load
+_BLOCKED_URL_PATTERNS = ('*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot')
+
+_driver_path = None
+_driver_path_lock = threading.Lock()
+
+def _start_chrome(options):
+    """Start Chrome, resolving the chromedriver binary at most once per process.
+
+    CHROMEDRIVER_PATH pins a binary. Otherwise Selenium Manager resolves one
+    for the first driver and later drivers reuse that path, so a pool of
+    checkers does not run Selenium Manager once per instance.
+    """
+    global _driver_path
+    pinned_path = os.environ.get('CHROMEDRIVER_PATH')
+    if pinned_path:
+        return webdriver.Chrome(service=Service(pinned_path), options=options)
+
+    with _driver_path_lock:
+        if _driver_path is None:
+            driver = webdriver.Chrome(options=options)
+            resolved_path = getattr(driver.service, 'path', None)
+            if isinstance(resolved_path, str):
+                _driver_path = resolved_path
+            return driver
+
+    return webdriver.Chrome(service=Service(_driver_path), options=options)
+
+# Seconds to wait for a map container after driver.get()
+_MAP_WAIT_TIMEOUT = 15
+
+# How long after navigation to keep waiting for a map container before
+# deciding the page has no map (milliseconds)
+_MAP_GRACE_MS = 3000
+
+# Map container selectors and JavaScript globals per map library
+_MAP_CONTAINER_SELECTORS = {
+    'leaflet': '.leaflet-container',
+    'openlayers': '.ol-viewport'
+}
+
+_MAP_GLOBALS = {
+    'leaflet': 'L',
+    'openlayers': 'ol'
+}
+
+# Attribution control selectors per map library
+_ATTRIBUTION_SELECTORS = {
+    'leaflet': '.leaflet-control-attribution',
+    'openlayers': '.ol-attribution'
+}
+
+# Results kept in the shared per-thread checker cache
+_RESULT_CACHE_SIZE = 1024
+_CACHE_MISS = object()
+
+def normalize_url(url):
+    """Normalize a URL so variants of one page compare equal.
+
+    The fragment is dropped, scheme and host are lowercased and a trailing
+    slash is removed from the path, except for the root path. Used for the
+    result cache keys and by the crawler to dedupe links.
+    """
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(),
+                       parts.path.rstrip('/') or '/', parts.query, ''))
+
+class _LRUCache:
+    """Thread-safe mapping that keeps only the maxsize most recently used entries."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
 class MapTilerAttributionChecker:
-    def __init__(self):
-        """Initialize the checker with Selenium WebDriver."""
-        options = Options()
-        options.add_argument('--headless')
-        options.add_argument('--no-sandbox')
-        options.add_argument('--disable-dev-shm-usage')
-        options.add_argument('--window-size=1920,1080')
-        self.driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+    def __init__(self, driver=None, cache=None):
+        """Initialize the checker with Selenium WebDriver.
+
+        Results are memoized by normalized URL in cache, which may be shared.
+        """
+        self._cache = {} if cache is None else cache
+        if driver is None:
+            options = Options()
+            options.add_argument('--headless')
+            options.add_argument('--no-sandbox')
+            options.add_argument('--disable-dev-shm-usage')
+            options.add_argument('--window-size=1920,1080')
+            # Detection only reads the DOM and src attributes, so skip
+            # downloading images.
+            options.add_argument('--blink-settings=imagesEnabled=false')
+            options.add_experimental_option('prefs', {
+                'profile.managed_default_content_settings.images': 2,
+                'profile.default_content_setting_values.notifications': 2
+            })
+            # Background services that only add network traffic and startup work
+            for argument in _CHROME_DISABLED_FEATURES:
+                options.add_argument(argument)
+            driver = _start_chrome(options)
+            # Web fonts never affect detection; block them at the network layer
+            driver.execute_cdp_cmd('Network.enable', {})
+            driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': list(_BLOCKED_URL_PATTERNS)})
+        self.driver = driver
 
     def __del__(self):
         """Clean up WebDriver resources."""
-        if hasattr(self, 'driver'):
-            self.driver.quit()
+        self.close()
+
+    def close(self):
+        """Quit the WebDriver. Safe to call more than once."""
+        driver = getattr(self, 'driver', None)
+        if driver is not None:
+            self.driver = None
+            driver.quit()
 
     def check_website(self, url):
-        """Check a website for MapTiler usage and proper attribution."""
+        """Check a website for MapTiler usage and proper attribution.
+
+        Successful checks are cached, so repeated URLs are not loaded again.
+        """
+        cache_key = normalize_url(url)
+        cached = self._cache.get(cache_key, _CACHE_MISS)
+        if cached is not _CACHE_MISS:
+            logging.info(f"Using cached result for {url}")
+            return cached
+
+        result, _ = self._check_website(url)
+        if not (result and 'error' in result):
+            self._cache[cache_key] = result
+        return result
+
+    def check_page(self, url):
+        """Check url like check_website and also return its links, bypassing the cache.
+
+        Returns (result, links); links is None if the check failed.
+        """
+        return self._check_website(url, collect_links=True)
+
+    def _check_website(self, url, collect_links=False):
+        """Load url and run detection and attribution checks on it.
+
+        Returns (result, links); links is None unless collect_links is set.
+        """
         try:
             logging.info(f"\nChecking {url}")
             self.driver.get(url)
+            self._wait_for_map()
 
-            # Get page source and execute JavaScript to gather information
-            page_source = self.driver.page_source.lower()
-            js_variables = self._get_map_variables()
+            # Gather page source, map URLs and attribution texts in one call
+            page_data = self._get_page_data(collect_links)
+            links = page_data.get('links')
 
             # Detect map library and MapTiler usage
-            detection_result = self._detect_map_usage(page_source, js_variables)
+            detection_result = self._detect_map_usage(page_data['html'], page_data)
 
             if not detection_result['using_maptiler']:
                 logging.info("No MapTiler usage detected")
-                return None
+                return None, links
 
             # Check attribution if MapTiler is being used
-            attribution_result = self._check_attribution(detection_result['library'])
+            attribution_result = self._check_attribution(detection_result['library'],
+                                                         page_data['attributionTexts'])
 
             result = {
                 'url': url,
@@ -56,7 +260,7 @@ class MapTilerAttributionChecker:
                 'maptiler_indicators': detection_result['indicators_found']
             }
 
-            return result
+            return result, links
 
         except Exception as e:
             logging.error(f"Error checking {url}: {str(e)}")
@@ -64,123 +268,251 @@ class MapTilerAttributionChecker:
                 'url': url,
                 'timestamp': datetime.now().isoformat(),
                 'error': str(e)
-            }
+            }, None
 
-    def _get_map_variables(self):
-        """Execute JavaScript to gather map-related variables."""
+    def _wait_for_map(self):
+        """Wait for a map container, or _MAP_GRACE_MS after navigation on pages without one."""
+        try:
+            WebDriverWait(self.driver, _MAP_WAIT_TIMEOUT, poll_frequency=0.2).until(
+                lambda driver: driver.execute_script(
+                    "return document.querySelector(arguments[0]) !== null"
+                    " || performance.now() > arguments[1];",
+                    ', '.join(_MAP_CONTAINER_SELECTORS.values()),
+                    _MAP_GRACE_MS
+                )
+            )
+        except TimeoutException:
+            logging.warning(f"Timed out after {_MAP_WAIT_TIMEOUT}s waiting for a map container")
+
+    def _get_page_data(self, collect_links=False):
+        """Collect everything detection and attribution need in one execute_script call.
+
+        Returns a dict with keys 'html' (lowercased source, or None when it
+        would not change the outcome), 'tileUrls', 'mapUrls', 'mapLibraries',
+        'attributionTexts' and 'links' (None unless collect_links).
+        """
         return self.driver.execute_script("""
-            function getTileUrls() {
+            // Attribute selectors let the browser filter nodes natively
+            // instead of visiting every <img>/<script> from JavaScript.
+            function getSrcs(selector) {
+                return Array.from(document.querySelectorAll(selector), el => el.src);
+            }
+
+            // OpenLayers draws tiles onto a canvas, so its tile URLs are read
+            // from the sources of every ol.Map reachable from window.
+            function getOpenLayersSourceUrls() {
                 const urls = [];
-                document.querySelectorAll('img').forEach(img => {
-                    if (img.src && img.src.includes('maptiler')) {
-                        urls.push(img.src);
+                if (!window.ol || typeof window.ol.Map !== 'function') {
+                    return urls;
+                }
+                try {
+                    for (const value of Object.values(window)) {
+                        if (!(value instanceof window.ol.Map)) {
+                            continue;
+                        }
+                        const layers = value.getAllLayers
+                            ? value.getAllLayers()
+                            : value.getLayers().getArray();
+                        for (const layer of layers) {
+                            const source = layer.getSource && layer.getSource();
+                            if (!source) {
+                                continue;
+                            }
+                            const sourceUrls = (source.getUrls && source.getUrls())
+                                || (source.getUrl && [source.getUrl()])
+                                || [];
+                            urls.push(...sourceUrls.filter(url => url && url.includes('maptiler')));
+                        }
                     }
-                });
+                } catch (e) {
+                    // Detection falls back to script URLs and page source
+                }
                 return urls;
             }
 
-            function getMapUrls() {
-                return Array.from(document.scripts)
-                    .map(script => script.src)
-                    .filter(src => src && src.includes('maptiler'));
+            function getTexts(selector) {
+                return Array.from(document.querySelectorAll(selector), el => el.innerText.toLowerCase());
+            }
+
+            const [attributionSelectors, containerSelectors, globals, maptilerPatterns, collectLinks] = arguments;
+            const attributionTexts = {};
+            for (const [library, selector] of Object.entries(attributionSelectors)) {
+                attributionTexts[library] = getTexts(selector);
+            }
+
+            const mapLibraries = {};
+            for (const [library, selector] of Object.entries(containerSelectors)) {
+                mapLibraries[library] = {
+                    containers: document.querySelectorAll(selector).length,
+                    global: typeof window[globals[library]] !== 'undefined'
+                };
+            }
+
+            const tileUrls = getSrcs('img[src*="maptiler"]').concat(getOpenLayersSourceUrls());
+            const mapUrls = getSrcs('script[src*="maptiler"]');
+            const hasMapTilerUrl = tileUrls.concat(mapUrls)
+                .some(url => maptilerPatterns.some(pattern => url.includes(pattern)));
+            const hasLibrary = Object.values(mapLibraries)
+                .some(signals => signals.containers > 0 || signals.global);
+
+            let html = null;
+            if (!(hasMapTilerUrl && hasLibrary)) {
+                html = document.documentElement.outerHTML.toLowerCase();
+                // Without any MapTiler reference the page is rejected anyway
+                if (!tileUrls.length && !mapUrls.length && !html.includes('maptiler')) {
+                    html = null;
+                }
             }
 
             return {
-                tileUrls: getTileUrls(),
-                mapUrls: getMapUrls()
+                html: html,
+                tileUrls: tileUrls,
+                mapUrls: mapUrls,
+                attributionTexts: attributionTexts,
+                mapLibraries: mapLibraries,
+                links: collectLinks ? Array.from(document.links, link => link.href) : null
             };
-        """)
+        """, _ATTRIBUTION_SELECTORS, _MAP_CONTAINER_SELECTORS, _MAP_GLOBALS, _MAPTILER_PATTERNS,
+            collect_links)
 
-    def _detect_map_usage(self, page_source, js_variables):
-        """Detect which map library is being used and if it's using MapTiler."""
-        logging.info("Detecting map library usage...")
+    def _get_attribution_texts(self, selector):
+        """Return the lowercased text of every element matching selector.
 
-        # Patterns to check for library presence
-        library_patterns = {
-            'Leaflet': ['leaflet.js', 'L.map(', 'L.tileLayer('],
-            'OpenLayers': ['ol.js', 'ol.Map', 'new ol.Map']
-        }
+        All texts are read in one execute_script call rather than one
+        WebDriver round-trip per element.
+        """
+        return self.driver.execute_script(
+            "return Array.from(document.querySelectorAll(arguments[0]), e => e.innerText.toLowerCase());",
+            selector
+        )
 
-        # Patterns to check for MapTiler usage
-        maptiler_patterns = [
-            'maptiler.com',
-            'maptiler-cdn',
-            'maptiler-server',
-            'maptiler.org'
-        ]
+    def _detect_map_usage(self, page_source, js_variables):
+        """Detect which map library is being used and if it's using MapTiler.
+
+        page_source may be None (see _get_page_data).
+        """
+        logging.debug("Detecting map library usage...")
+
+        # Most pages never mention MapTiler; one scan rules them out before
+        # enumerating the individual patterns. Tile and script URLs are
+        # already filtered on 'maptiler' by _get_page_data.
+        has_maptiler_hint = ((page_source is not None and 'maptiler' in page_source)
+                             or bool(js_variables['tileUrls'])
+                             or bool(js_variables['mapUrls']))
+        if not has_maptiler_hint:
+            logging.debug("No MapTiler reference found on page")
+            return {
+                'using_maptiler': False,
+                'library': None,
+                'indicators_found': []
+            }
 
         detected_library = None
-        found_indicators = []
+        # Insertion-ordered set: a URL matching several patterns is reported once
+        found_indicators = {}
+        script_urls = [(url, url.lower()) for url in js_variables['mapUrls']]
+        map_libraries = js_variables.get('mapLibraries', {})
 
         # Check for library usage
-        for library, patterns in library_patterns.items():
+        for library, patterns in _LIBRARY_PATTERNS.items():
             library_found = False
-            for pattern in patterns:
-                if pattern.lower() in page_source:
-                    if not library_found:
-                        logging.info(f"Found {library} through pattern: {pattern}")
-                        library_found = True
-                        if not detected_library:
-                            detected_library = library
-                    found_indicators.append(f"{library}:pattern:{pattern}")
+            if page_source is not None:
+                for pattern in patterns:
+                    if pattern in page_source:
+                        if not library_found:
+                            logging.debug("Found %s through pattern: %s", library, pattern)
+                            library_found = True
+                            if not detected_library:
+                                detected_library = library
+                        found_indicators[f"{library}:pattern:{pattern}"] = None
 
             # Check script sources for library files
-            for url in js_variables['mapUrls']:
-                if any(pattern in url.lower() for pattern in [library.lower() + '.js',
-                                                          library.lower() + '.min.js']):
+            for url, url_lower in script_urls:
+                if any(pattern in url_lower for pattern in _LIBRARY_SCRIPT_PATTERNS[library]):
                     if not library_found:
-                        logging.info(f"Found {library} through script URL: {url}")
+                        logging.debug("Found %s through script URL: %s", library, url)
                         library_found = True
                         if not detected_library:
                             detected_library = library
-                    found_indicators.append(f"{library}:script:{url}")
+                    found_indicators[f"{library}:script:{url}"] = None
+
+            # Check map containers and globals reported by the browser
+            library_key = library.lower()
+            signals = map_libraries.get(library_key, {})
+            browser_indicators = []
+            if signals.get('containers'):
+                browser_indicators.append(f"{library}:container:{_MAP_CONTAINER_SELECTORS[library_key]}")
+            if signals.get('global'):
+                browser_indicators.append(f"{library}:global:{_MAP_GLOBALS[library_key]}")
+            for indicator in browser_indicators:
+                if not library_found:
+                    logging.debug("Found %s through browser state: %s", library, indicator)
+                    library_found = True
+                    if not detected_library:
+                        detected_library = library
+                found_indicators[indicator] = None
 
         # Check for MapTiler usage in various contexts
-        logging.info("Checking for MapTiler usage...")
+        logging.debug("Checking for MapTiler usage...")
         maptiler_found = False
 
-
-        # Check in tile URLs first (most reliable indicator)
-        for url in js_variables['tileUrls']:
-            for pattern in maptiler_patterns:
-                if pattern in url:
-                    if not maptiler_found:
-                        logging.info(f"Found MapTiler tile URL: {url}")
-                        maptiler_found = True
-                    found_indicators.append(f"tile:{url}")
-
-        # Check in script sources
-        for url in js_variables['mapUrls']:
-            if url:  # Only check non-empty URLs
-                for pattern in maptiler_patterns:
-                    if pattern in url:
-                        if not maptiler_found:
-                            logging.info(f"Found MapTiler script URL: {url}")
-                            maptiler_found = True
-                        found_indicators.append(f"script:{url}")
-
-        # Check in page source
-        for pattern in maptiler_patterns:
-            if pattern in page_source:
+        # Check tile URLs first (most reliable indicator), then script sources
+        url_sources = itertools.chain(
+            (('tile', url) for url in js_variables['tileUrls']),
+            (('script', url) for url in js_variables['mapUrls'])
+        )
+        for kind, url in url_sources:
+            if url and any(pattern in url for pattern in _MAPTILER_PATTERNS):
+                if not maptiler_found:
+                    logging.debug("Found MapTiler %s URL: %s", kind, url)
+                    maptiler_found = True
+                found_indicators[f"{kind}:{url}"] = None
+
+        # Check in page source, the most expensive scan, only when no URL
+        # has already confirmed MapTiler usage
+        source_matches = (set() if page_source is None or maptiler_found
+                          else self._scan_page_source(page_source))
+        for pattern in _MAPTILER_PATTERNS:
+            if pattern in source_matches:
                 if not maptiler_found:
-                    logging.info(f"Found MapTiler pattern in page source: {pattern}")
+                    logging.debug("Found MapTiler pattern in page source: %s", pattern)
                     maptiler_found = True
-                found_indicators.append(f"source:{pattern}")
+                found_indicators[f"source:{pattern}"] = None
 
-        is_using_maptiler = len(found_indicators) > 0
+        # Library indicators only say which map is drawn; usage needs a
+        # MapTiler URL or pattern
+        is_using_maptiler = maptiler_found
         logging.info(f"Map usage detection complete. Using MapTiler: {is_using_maptiler}, Library: {detected_library}")
-        if detected_library:
-            logging.info(f"Detected indicators: {', '.join(found_indicators)}")
+        if detected_library and logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("Detected indicators: %s", ', '.join(found_indicators))
 
         return {
             'using_maptiler': is_using_maptiler,
             'library': detected_library,
-            'indicators_found': found_indicators
+            'indicators_found': list(found_indicators)
         }
 
-    def _check_attribution(self, library_type):
-        """Check if proper attribution is present based on the library type."""
-        logging.info(f"Checking attribution for {library_type} library...")
+    def _scan_page_source(self, page_source):
+        """Return the MapTiler patterns found in page_source, head first.
+
+        Patterns that only appear past _SOURCE_HEAD_SIZE are not reported when
+        the head already matched; usage is confirmed either way.
+        """
+        matches = {match.group(0)
+                   for match in _MAPTILER_RE.finditer(page_source, 0, _SOURCE_HEAD_SIZE)}
+        if not matches and len(page_source) > _SOURCE_HEAD_SIZE:
+            # Back up so a pattern straddling the boundary is still matched
+            start = _SOURCE_HEAD_SIZE - max(map(len, _MAPTILER_PATTERNS)) + 1
+            matches = {match.group(0) for match in _MAPTILER_RE.finditer(page_source, start)}
+        return matches
+
+    def _check_attribution(self, library_type, attribution_texts=None):
+        """Check if proper attribution is present based on the library type.
+
+        attribution_texts maps library keys to already collected texts (see
+        _get_page_data); when omitted they are read from the page.
+        """
+        logging.debug("Checking attribution for %s library...", library_type)
 
         if not library_type:
             return {
@@ -188,33 +520,19 @@ class MapTilerAttributionChecker:
                 'issues': ['Unknown library type: None']
             }
 
-        # Common attribution patterns
-        maptiler_attribution = [
-            'maptiler',
-            '© maptiler',
-            'mapTiler',
-            '© MapTiler',
-            'MapTiler Cloud'
-        ]
-
-        osm_attribution = [
-            'openstreetmap',
-            '© openstreetmap',
-            '© OpenStreetMap',
-            'OpenStreetMap contributors'
-        ]
-
         try:
             attribution_found = False
-            attribution_elements = []
+            library_key = library_type.lower()
 
             # Check for attribution elements based on library type
-            if library_type.lower() == 'leaflet':
-                attribution_elements = self.driver.find_elements(By.CLASS_NAME, 'leaflet-control-attribution')
-            elif library_type.lower() == 'openlayers':
-                attribution_elements = self.driver.find_elements(By.CLASS_NAME, 'ol-attribution')
+            if attribution_texts is not None:
+                attribution_texts = attribution_texts.get(library_key, [])
+            elif library_key in _ATTRIBUTION_SELECTORS:
+                attribution_texts = self._get_attribution_texts(_ATTRIBUTION_SELECTORS[library_key])
+            else:
+                attribution_texts = []
 
-            if not attribution_elements:
+            if not attribution_texts:
                 logging.warning(f"No attribution elements found for {library_type}")
                 return {
                     'has_proper_attribution': False,
@@ -223,12 +541,11 @@ class MapTilerAttributionChecker:
 
             # Check attribution text
             issues = []
-            for element in attribution_elements:
-                attribution_text = element.text.lower()
-                logging.info(f"Found attribution text: {attribution_text}")
+            for attribution_text in attribution_texts:
+                logging.debug("Found attribution text: %s", attribution_text)
 
-                maptiler_found = any(pattern.lower() in attribution_text for pattern in maptiler_attribution)
-                osm_found = any(pattern.lower() in attribution_text for pattern in osm_attribution)
+                maptiler_found = _MAPTILER_ATTRIBUTION in attribution_text
+                osm_found = _OSM_ATTRIBUTION in attribution_text
 
                 if not maptiler_found:
                     issues.append('Missing MapTiler attribution')
@@ -259,74 +576,268 @@ class MapTilerAttributionChecker:
                 'issues': [f'Error checking attribution: {str(e)}']
             }
 
+# Markers whose absence from a page's raw HTML rules out a MapTiler map
+_PREFILTER_MARKERS = ('leaflet', 'openlayers', 'ol.js', 'maptiler')
+_PREFILTER_WORKERS = 32
+_PREFILTER_TIMEOUT = 10
+_PREFILTER_HTML_TYPES = ('text/html', 'application/xhtml')
+_PREFILTER_MAX_BYTES = 2 * 1024 * 1024
+_PREFILTER_USER_AGENT = 'Mozilla/5.0 (compatible; MapTilerAttributionChecker)'
+
+_thread_local = threading.local()
+# Shared by the per-thread checkers; bounded so memory stays flat on long URL lists
+_result_cache = _LRUCache(_RESULT_CACHE_SIZE)
+_thread_checkers = []
+_thread_checkers_lock = threading.Lock()
+
+def get_thread_checker():
+    """Return the checker owned by the calling thread, creating it on first use.
+
+    Each worker thread gets its own Chrome process, since a WebDriver session
+    cannot be shared between threads.
+    """
+    checker = getattr(_thread_local, 'checker', None)
+    if checker is None:
+        checker = MapTilerAttributionChecker(cache=_result_cache)
+        _thread_local.checker = checker
+        with _thread_checkers_lock:
+            _thread_checkers.append(checker)
+    return checker
+
+@atexit.register
+def close_thread_checkers():
+    """Quit the drivers of all per-thread checkers."""
+    with _thread_checkers_lock:
+        checkers = list(_thread_checkers)
+        _thread_checkers.clear()
+    for checker in checkers:
+        checker.close()
+
+def _check_url(url):
+    """Check a single URL using the calling thread's checker."""
+    return get_thread_checker().check_website(url)
+
+def _read_urls(urls_file=None, url=None):
+    """Lazily yield URLs from urls_file (one per line), then url."""
+    if urls_file:
+        with open(urls_file, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield line
+    if url:
+        yield url
+
+def _map_completed(func, items, max_workers):
+    """Run func over items on a thread pool, yielding (item, future) as each completes.
+
+    Only a bounded window of items is submitted at a time, so items may be
+    an arbitrarily long iterator.
+    """
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(func, item): item
+                   for item in itertools.islice(items, max_workers * 2)}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                next_item = next(items, None)
+                if next_item is not None:
+                    pending[executor.submit(func, next_item)] = next_item
+                yield item, future
+
+def _check_urls(urls, max_workers):
+    """Check URLs on a worker pool, yielding (url, result) as each completes."""
+    for url, future in _map_completed(_check_url, urls, max_workers):
+        try:
+            result = future.result()
+        except Exception as e:
+            logging.error(f"Error checking {url}: {str(e)}")
+            result = {
+                'url': url,
+                'timestamp': datetime.now().isoformat(),
+                'error': str(e)
+            }
+        yield url, result
+
+def _might_use_maptiler(session, url):
+    """Fetch url over plain HTTP and report whether its HTML could hold a MapTiler map.
+
+    Pages that cannot be fetched are kept, so the browser check has the final say.
+    Non-HTML responses are dropped from their headers, and at most
+    _PREFILTER_MAX_BYTES of the body is read.
+    """
+    try:
+        response = session.get(url, timeout=_PREFILTER_TIMEOUT, stream=True)
+    except requests.RequestException as e:
+        logging.warning(f"Prefilter could not fetch {url}: {str(e)}")
+        return True
+    try:
+        if not response.ok:
+            return True
+        # Media types are case-insensitive
+        content_type = response.headers.get('Content-Type', '').lower()
+        if not content_type.startswith(_PREFILTER_HTML_TYPES):
+            return False
+        body = response.raw.read(_PREFILTER_MAX_BYTES, decode_content=True)
+    except Urllib3HTTPError as e:
+        logging.warning(f"Prefilter could not read {url}: {str(e)}")
+        return True
+    finally:
+        response.close()
+    html = body.decode(response.encoding or 'utf-8', errors='replace').lower()
+    return any(marker in html for marker in _PREFILTER_MARKERS)
+
+def _prefilter_urls(urls, max_workers=_PREFILTER_WORKERS):
+    """Yield only the URLs whose raw HTML mentions a map library or MapTiler.
+
+    Plain HTTP requests are far cheaper than a browser page load, so most
+    pages without a map never reach Chrome.
+    """
+    with requests.Session() as session:
+        session.headers['User-Agent'] = _PREFILTER_USER_AGENT
+        # One pooled connection per worker instead of the default pool of 10
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        for url, future in _map_completed(partial(_might_use_maptiler, session), urls, max_workers):
+            if future.result():
+                yield url
+            else:
+                print(f"{url}: No map library or MapTiler reference in HTML (skipped)")
+
+def _report_results(urls, max_workers):
+    """Check URLs, print a summary line for each and yield the results to save."""
+    for url, result in _check_urls(urls, max_workers):
+        if result:
+            print(f"{url}: Found MapTiler usage with {result.get('map_library', 'unknown library')}: "
+                  f"{'Proper' if result.get('has_proper_attribution') else 'Improper'} attribution")
+            yield result
+        else:
+            print(f"{url}: No MapTiler usage detected or SDK usage found (excluded)")
+
+_CSV_FIELDNAMES = (
+    'url',
+    'uses_maptiler',
+    'map_library',
+    'has_proper_attribution',
+    'issues',
+    'indicators',
+    'error',
+    'timestamp'
+)
+
+def _flatten_result(result):
+    """Flatten a single result into a CSV row."""
+    return {
+        'url': result['url'],
+        'uses_maptiler': result.get('uses_maptiler', False),
+        'map_library': result.get('map_library', ''),
+        'has_proper_attribution': result.get('has_proper_attribution', False),
+        'issues': '; '.join(result.get('issues', [])),
+        'indicators': '; '.join(result.get('maptiler_indicators', [])),
+        'error': result.get('error', ''),
+        'timestamp': result['timestamp']
+    }
+
+def _default_output_file(output_format):
+    """Return a timestamped report file name for output_format."""
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return f'maptiler_attribution_report_{timestamp}.{output_format}'
+
+class ResultWriter:
+    """Write results to a JSON, JSON Lines or CSV file one at a time as they arrive.
+
+    Each result is flushed as it is written; JSON output is only a complete
+    array once the writer is closed.
+    """
+
+    def __init__(self, output_file, output_format='json'):
+        if output_format not in ('json', 'jsonl', 'csv'):
+            raise ValueError(f"Unsupported output format: {output_format}")
+        self.output_file = output_file
+        self.output_format = output_format
+        self._count = 0
+
+        if output_format == 'json':
+            self._file = open(output_file, 'w')
+            self._file.write('[')
+        elif output_format == 'jsonl':
+            self._file = open(output_file, 'w')
+        else:
+            self._file = open(output_file, 'w', newline='')
+            self._writer = csv.DictWriter(self._file, fieldnames=_CSV_FIELDNAMES)
+            self._writer.writeheader()
+        self._file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, result):
+        """Append a result to the output file. None results are skipped."""
+        if result is None:
+            return
+        if self.output_format == 'json':
+            self._file.write(',\n' if self._count else '\n')
+            self._file.write(json.dumps(result, indent=2))
+        elif self.output_format == 'jsonl':
+            self._file.write(json.dumps(result) + '\n')
+        else:
+            self._writer.writerow(_flatten_result(result))
+        self._count += 1
+        self._file.flush()
+
+    def close(self):
+        """Finish the output file. Safe to call more than once."""
+        if self._file.closed:
+            return
+        if self.output_format == 'json':
+            self._file.write('\n]' if self._count else ']')
+        self._file.close()
+
 def save_results(results, output_format='json', output_file=None):
     """Save results to a file in the specified format."""
     if not output_file:
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        output_file = f'maptiler_attribution_report_{timestamp}.{output_format}'
-
-    if output_format == 'json':
-        with open(output_file, 'w') as f:
-            json.dump(results, f, indent=2)
-    elif output_format == 'csv':
-        if not results:
-            return
+        output_file = _default_output_file(output_format)
 
-        # Flatten the results for CSV format
-        flattened_results = []
+    with ResultWriter(output_file, output_format) as writer:
         for result in results:
-            if result is None:
-                continue
-            flat_result = {
-                'url': result['url'],
-                'uses_maptiler': result.get('uses_maptiler', False),
-                'map_library': result.get('map_library', ''),
-                'has_proper_attribution': result.get('has_proper_attribution', False),
-                'issues': '; '.join(result.get('issues', [])) if 'issues' in result else '',
-                'indicators': '; '.join(result.get('maptiler_indicators', [])) if 'maptiler_indicators' in result else '',
-                'error': result.get('error', ''),
-                'timestamp': result['timestamp']
-            }
-            flattened_results.append(flat_result)
+            writer.write(result)
 
-        with open(output_file, 'w', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=flattened_results[0].keys())
-            writer.writeheader()
-            writer.writerows(flattened_results)
+    return output_file
 
 def main():
     parser = argparse.ArgumentParser(description='Check websites for proper MapTiler attribution in Leaflet/OpenLayers maps')
     parser.add_argument('--urls', type=str, help='File containing URLs to check (one per line)')
     parser.add_argument('--url', type=str, help='Single URL to check')
-    parser.add_argument('--format', choices=['json', 'csv'], default='json', help='Output format (default: json)')
+    parser.add_argument('--format', choices=['json', 'jsonl', 'csv'], default='json',
+                        help='Output format (default: json)')
     parser.add_argument('--output', type=str, help='Output file path')
+    parser.add_argument('--workers', type=int, default=8, help='Number of parallel browser workers (default: 8)')
+    parser.add_argument('--prefilter', action='store_true',
+                        help='Skip URLs whose raw HTML mentions no map library or MapTiler before opening them in Chrome')
     args = parser.parse_args()
 
     if not args.urls and not args.url:
         parser.error("Either --urls or --url must be provided")
 
-    urls = []
-    if args.urls:
-        with open(args.urls, 'r') as f:
-            urls.extend(line.strip() for line in f if line.strip())
-    if args.url:
-        urls.append(args.url)
+    urls = _read_urls(args.urls, args.url)
+    if args.prefilter:
+        urls = _prefilter_urls(urls)
 
-    checker = MapTilerAttributionChecker()
-    results = []
-
-    for url in urls:
-        print(f"Checking {url}...")
-        result = checker.check_website(url)
-        if result:
-            results.append(result)
-            print(f"Found MapTiler usage with {result.get('map_library', 'unknown library')}: "
-                  f"{'Proper' if result.get('has_proper_attribution') else 'Improper'} attribution")
-        else:
-            print("No MapTiler usage detected or SDK usage found (excluded)")
+    output_file = args.output or _default_output_file(args.format)
 
-    save_results(results, args.format, args.output)
-    print(f"\nResults saved to {args.output or 'maptiler_attribution_report_<timestamp>.' + args.format}")
+    try:
+        with ResultWriter(output_file, args.format) as writer:
+            for result in _report_results(urls, args.workers):
+                writer.write(result)
+    finally:
+        close_thread_checkers()
+    print(f"\nResults saved to {output_file}")
 
 if __name__ == "__main__":
     main()
@@ -1,5 +1,10 @@
 import pytest
-from attribution_checker import MapTilerAttributionChecker
+import csv
+import json
+import threading
+import attribution_checker
+from attribution_checker import (MapTilerAttributionChecker, ResultWriter, get_thread_checker,
+                                 close_thread_checkers, normalize_url, save_results)
 from unittest.mock import MagicMock, patch
 
 @pytest.fixture
@@ -14,6 +19,72 @@ def test_init(checker):
     """Test checker initialization."""
     assert isinstance(checker, MapTilerAttributionChecker)
 
+def test_driver_path_from_env(monkeypatch):
+    """Test CHROMEDRIVER_PATH pins the driver binary."""
+    monkeypatch.setenv('CHROMEDRIVER_PATH', '/usr/bin/chromedriver')
+    with patch('attribution_checker.Service') as mock_service, \
+         patch('attribution_checker.webdriver.Chrome') as mock_chrome:
+        MapTilerAttributionChecker()
+
+    mock_service.assert_called_once_with('/usr/bin/chromedriver')
+    assert mock_chrome.call_args.kwargs['service'] is mock_service.return_value
+
+def test_selenium_manager_resolves_once(monkeypatch):
+    """Test the driver path found by Selenium Manager is reused by later checkers."""
+    monkeypatch.delenv('CHROMEDRIVER_PATH', raising=False)
+    monkeypatch.setattr(attribution_checker, '_driver_path', None)
+    with patch('attribution_checker.Service') as mock_service, \
+         patch('attribution_checker.webdriver.Chrome') as mock_chrome:
+        mock_chrome.return_value.service.path = '/cache/selenium/chromedriver'
+        MapTilerAttributionChecker()
+        MapTilerAttributionChecker()
+
+    assert 'service' not in mock_chrome.call_args_list[0].kwargs
+    mock_service.assert_called_once_with('/cache/selenium/chromedriver')
+    assert mock_chrome.call_args_list[1].kwargs['service'] is mock_service.return_value
+
+def test_chrome_options_skip_images():
+    """Test Chrome is configured to skip images and waits for the load event."""
+    with patch('attribution_checker.webdriver.Chrome') as mock_chrome:
+        MapTilerAttributionChecker()
+
+    options = mock_chrome.call_args.kwargs['options']
+    assert '--blink-settings=imagesEnabled=false' in options.arguments
+    assert options.experimental_options['prefs']['profile.managed_default_content_settings.images'] == 2
+    assert options.page_load_strategy == 'normal'
+    assert '--disable-background-networking' in options.arguments
+    mock_chrome.return_value.execute_cdp_cmd.assert_any_call(
+        'Network.setBlockedURLs', {'urls': ['*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot']}
+    )
+
+def test_close_is_idempotent():
+    """Test closing a checker quits its driver only once."""
+    driver = MagicMock()
+    checker = MapTilerAttributionChecker(driver=driver)
+    checker.close()
+    checker.close()
+    driver.quit.assert_called_once()
+
+def test_thread_checker_per_thread():
+    """Test each thread gets its own checker, reused across calls."""
+    with patch('attribution_checker.webdriver.Chrome'):
+        main_checker = get_thread_checker()
+        assert get_thread_checker() is main_checker
+
+        other = []
+        thread = threading.Thread(target=lambda: other.append(get_thread_checker()))
+        thread.start()
+        thread.join()
+
+        assert other[0] is not main_checker
+        assert len(attribution_checker._thread_checkers) == 2
+
+        close_thread_checkers()
+        assert attribution_checker._thread_checkers == []
+        assert main_checker.driver is None
+        assert other[0].driver is None
+        attribution_checker._thread_local.checker = None
+
 def test_detect_leaflet_usage(checker):
     """Test detection of Leaflet usage."""
     # Mock page source with Leaflet indicators
@@ -60,22 +131,79 @@ def test_detect_openlayers_usage(checker):
     assert result['library'] == 'OpenLayers'
     assert len(result['indicators_found']) > 0
 
+def test_detect_deduplicates_indicators(checker):
+    """Test the same tile URL is reported once, in discovery order."""
+    tile_url = 'https://api.maptiler.com/maps/basic/256/10/12/15.png'
+    js_variables = {'tileUrls': [tile_url, tile_url], 'mapUrls': []}
+
+    result = checker._detect_map_usage('<script src="leaflet.js"></script>', js_variables)
+
+    assert result['indicators_found'] == ['Leaflet:pattern:leaflet.js', f'tile:{tile_url}']
+
+def test_detect_skips_source_scan_after_url_match(checker):
+    """Test page source is only scanned for MapTiler when no URL matched."""
+    page_source = '<script>var tiles = "https://api.maptiler.com/maps/{z}/{x}/{y}.png";</script>'
+
+    with_url = checker._detect_map_usage(page_source, {
+        'tileUrls': ['https://api.maptiler.com/maps/streets/0/0/0.png'],
+        'mapUrls': []
+    })
+    without_url = checker._detect_map_usage(page_source, {'tileUrls': [], 'mapUrls': []})
+
+    assert 'source:maptiler.com' not in with_url['indicators_found']
+    assert without_url['indicators_found'] == ['source:maptiler.com']
+
+def test_detect_scans_page_source_head_first(checker):
+    """Test the tail of a large page is only scanned when the head has no match."""
+    head_size = attribution_checker._SOURCE_HEAD_SIZE
+    js_variables = {'tileUrls': [], 'mapUrls': []}
+    padding = ' ' * head_size
+
+    head_hit = checker._detect_map_usage('maptiler.com' + padding + 'maptiler-cdn', js_variables)
+    # 'maptiler-cdn' straddles the head boundary
+    tail_hit = checker._detect_map_usage(padding[:-4] + 'maptiler-cdn', js_variables)
+
+    assert head_hit['indicators_found'] == ['source:maptiler.com']
+    assert tail_hit['indicators_found'] == ['source:maptiler-cdn']
+
+def test_detect_library_mentioning_maptiler_without_pattern(checker):
+    """Test a map library page that merely names MapTiler is not reported as using it."""
+    page_source = '<script src="leaflet.js"></script> we compared mapbox and maptiler'
+    js_variables = {'tileUrls': [], 'mapUrls': [],
+                    'mapLibraries': {'leaflet': {'containers': 1, 'global': True}}}
+
+    result = checker._detect_map_usage(page_source, js_variables)
+
+    assert result['using_maptiler'] == False
+    assert result['library'] == 'Leaflet'
+
+def test_detect_without_maptiler_reference(checker):
+    """Test pages that never mention MapTiler are rejected early."""
+    page_source = '<script src="leaflet.js"></script><script>l.map("map")</script>'
+    js_variables = {'tileUrls': [], 'mapUrls': []}
+
+    result = checker._detect_map_usage(page_source, js_variables)
+
+    assert result['using_maptiler'] == False
+    assert result['library'] is None
+    assert result['indicators_found'] == []
+
 def test_check_attribution_leaflet(checker):
     """Test attribution checking for Leaflet."""
-    # Mock attribution element
-    mock_element = MagicMock()
-    mock_element.text = "© MapTiler © OpenStreetMap contributors"
-    checker.driver.find_elements.return_value = [mock_element]
+    # Mock attribution element text
+    checker.driver.execute_script.return_value = ["© maptiler © openstreetmap contributors"]
 
     result = checker._check_attribution('Leaflet')
 
+    assert checker.driver.execute_script.call_args.args[1] == '.leaflet-control-attribution'
+
     assert result['has_proper_attribution'] == True
     assert len(result['issues']) == 0
 
 def test_check_attribution_missing(checker):
     """Test detection of missing attribution."""
     # Mock missing attribution
-    checker.driver.find_elements.return_value = []
+    checker.driver.execute_script.return_value = []
 
     result = checker._check_attribution('Leaflet')
 
@@ -85,19 +213,238 @@ def test_check_attribution_missing(checker):
 def test_check_website_integration(checker):
     """Test complete website checking flow."""
     # Mock successful detection and attribution check
-    checker.driver.page_source = "<script>L.map('map')</script>"
     checker.driver.execute_script.return_value = {
+        'html': "<script>l.map('map')</script>",
         'tileUrls': ['https://api.maptiler.com/maps/basic/256/10/12/15.png'],
-        'mapUrls': ['leaflet.js']
+        'mapUrls': ['leaflet.js'],
+        'attributionTexts': {
+            'leaflet': ["© maptiler © openstreetmap contributors"],
+            'openlayers': []
+        }
     }
 
-    mock_element = MagicMock()
-    mock_element.text = "© MapTiler © OpenStreetMap contributors"
-    checker.driver.find_elements.return_value = [mock_element]
-
     result = checker.check_website("https://example.com")
 
     assert result is not None
     assert result['uses_maptiler'] == True
     assert result['map_library'] == 'Leaflet'
     assert result['has_proper_attribution'] == True
+    page_data_calls = [call for call in checker.driver.execute_script.call_args_list
+                       if 'attributionTexts' in call.args[0]]
+    assert len(page_data_calls) == 1
+
+def test_check_website_without_page_source(checker):
+    """Test decisive JavaScript signals are used when the page source is skipped."""
+    checker.driver.execute_script.return_value = {
+        'html': None,
+        'tileUrls': ['https://api.maptiler.com/maps/basic/256/10/12/15.png'],
+        'mapUrls': [],
+        'attributionTexts': {
+            'leaflet': [],
+            'openlayers': ["© maptiler © openstreetmap contributors"]
+        },
+        'mapLibraries': {
+            'leaflet': {'containers': 0, 'global': False},
+            'openlayers': {'containers': 1, 'global': True}
+        }
+    }
+
+    result = checker.check_website("https://example.com")
+
+    assert result['uses_maptiler'] == True
+    assert result['map_library'] == 'OpenLayers'
+    assert result['has_proper_attribution'] == True
+    assert 'OpenLayers:container:.ol-viewport' in result['maptiler_indicators']
+    assert 'OpenLayers:global:ol' in result['maptiler_indicators']
+
+def test_wait_for_map_times_out(checker):
+    """Test a page that never becomes ready does not abort the check."""
+    checker.driver.execute_script.return_value = False
+    with patch('attribution_checker._MAP_WAIT_TIMEOUT', 0):
+        checker._wait_for_map()
+
+def test_wait_for_map_polls_for_container(checker):
+    """Test the wait polls for a map container with a grace period for map-less pages."""
+    checker.driver.execute_script.side_effect = [False, False, True]
+    checker._wait_for_map()
+
+    assert checker.driver.execute_script.call_count == 3
+    script, selectors, grace_ms = checker.driver.execute_script.call_args.args
+    assert 'performance.now() > arguments[1]' in script
+    assert selectors == '.leaflet-container, .ol-viewport'
+    assert grace_ms == attribution_checker._MAP_GRACE_MS
+
+def test_check_website_rejects_without_page_source(checker):
+    """Test pages the browser found no MapTiler reference on are rejected."""
+    checker.driver.execute_script.return_value = {
+        'html': None,
+        'tileUrls': [],
+        'mapUrls': [],
+        'attributionTexts': {'leaflet': ["© openstreetmap contributors"], 'openlayers': []},
+        'mapLibraries': {
+            'leaflet': {'containers': 1, 'global': True},
+            'openlayers': {'containers': 0, 'global': False}
+        }
+    }
+
+    assert checker.check_website("https://example.com") is None
+
+def test_check_website_cached(checker):
+    """Test repeated URLs reuse the cached result instead of reloading."""
+    checker.driver.execute_script.return_value = {
+        'html': '<html></html>',
+        'tileUrls': [],
+        'mapUrls': [],
+        'attributionTexts': {}
+    }
+
+    assert checker.check_website("https://Example.com/map/") is None
+    assert checker.check_website("https://example.com/map") is None
+    checker.driver.get.assert_called_once_with("https://Example.com/map/")
+
+def test_normalize_url():
+    """Test page variants share one key for the cache and the crawler."""
+    variants = ['https://Example.com', 'https://example.com/', 'https://example.com/#top']
+    assert {normalize_url(url) for url in variants} == {'https://example.com/'}
+    assert normalize_url('HTTPS://example.com/a/?q=1#x') == 'https://example.com/a?q=1'
+
+def test_check_page_returns_links(checker):
+    """Test check_page reads the page's links from the same browser load."""
+    checker.driver.execute_script.side_effect = [True, {
+        'html': None,
+        'tileUrls': [],
+        'mapUrls': [],
+        'attributionTexts': {},
+        'mapLibraries': {},
+        'links': ['https://example.com/about']
+    }]
+
+    result, links = checker.check_page('https://example.com')
+
+    assert result is None
+    assert links == ['https://example.com/about']
+    assert checker.driver.execute_script.call_args.args[-1] == True
+    # Crawled pages are visited once, so their results are not cached
+    assert checker._cache == {}
+
+def test_result_cache_is_bounded():
+    """Test the shared result cache evicts the least recently used entry."""
+    cache = attribution_checker._LRUCache(2)
+    cache['a'] = None
+    cache['b'] = {'url': 'b'}
+    assert cache.get('a', 'missing') is None
+    cache['c'] = {'url': 'c'}
+
+    assert len(cache) == 2
+    assert cache.get('b', 'missing') == 'missing'
+    assert isinstance(attribution_checker._result_cache, attribution_checker._LRUCache)
+
+def test_check_website_errors_not_cached(checker):
+    """Test failed checks are retried on the next call."""
+    checker.driver.get.side_effect = Exception("timeout")
+
+    assert checker.check_website("https://example.com")['error'] == "timeout"
+    checker.check_website("https://example.com")
+    assert checker.driver.get.call_count == 2
+
+def test_save_results_csv(tmp_path):
+    """Test CSV output flattens results and skips empty entries."""
+    results = [
+        {
+            'url': 'https://example.com',
+            'timestamp': '2024-01-01T00:00:00',
+            'uses_maptiler': True,
+            'map_library': 'Leaflet',
+            'has_proper_attribution': False,
+            'issues': ['Missing MapTiler attribution', 'Missing OpenStreetMap attribution'],
+            'maptiler_indicators': ['tile:https://api.maptiler.com/tiles/0/0/0.png']
+        },
+        None,
+        {'url': 'https://broken.example.com', 'timestamp': '2024-01-01T00:00:01', 'error': 'timeout'}
+    ]
+
+    output_file = tmp_path / "report.csv"
+    save_results(results, 'csv', str(output_file))
+
+    with open(output_file, newline='') as f:
+        rows = list(csv.DictReader(f))
+
+    assert len(rows) == 2
+    assert rows[0]['issues'] == 'Missing MapTiler attribution; Missing OpenStreetMap attribution'
+    assert rows[1]['error'] == 'timeout'
+    assert rows[1]['indicators'] == ''
+
+def test_save_results_json_streams_generator(tmp_path):
+    """Test JSON output accepts a generator and produces a valid array."""
+    results = ({'url': f'https://example.com/{i}', 'uses_maptiler': True} for i in range(3))
+
+    output_file = tmp_path / "report.json"
+    assert save_results(results, 'json', str(output_file)) == str(output_file)
+
+    with open(output_file) as f:
+        data = json.load(f)
+    assert [r['url'] for r in data] == [f'https://example.com/{i}' for i in range(3)]
+
+    save_results(iter([]), 'json', str(output_file))
+    with open(output_file) as f:
+        assert json.load(f) == []
+
+def test_result_writer_flushes_each_result(tmp_path):
+    """Test each written result is on disk before the writer is closed."""
+    output_file = tmp_path / "report.csv"
+    with ResultWriter(str(output_file), 'csv') as writer:
+        writer.write({'url': 'https://example.com', 'timestamp': '2024-01-01T00:00:00'})
+        with open(output_file, newline='') as f:
+            assert [row['url'] for row in csv.DictReader(f)] == ['https://example.com']
+
+    with pytest.raises(ValueError):
+        ResultWriter(str(tmp_path / "report.xml"), 'xml')
+
+def test_result_writer_jsonl(tmp_path):
+    """Test JSON Lines output holds one complete result per line."""
+    output_file = tmp_path / "results.jsonl"
+    results = [{'url': 'https://a.example', 'uses_maptiler': True},
+               {'url': 'https://b.example', 'uses_maptiler': True}]
+
+    with ResultWriter(str(output_file), 'jsonl') as writer:
+        for result in results:
+            writer.write(result)
+
+    assert [json.loads(line) for line in output_file.read_text().splitlines()] == results
+
+def test_check_urls_bounded_window():
+    """Test every URL from an iterator is checked and reported once."""
+    urls = (f'https://example.com/{i}' for i in range(10))
+    with patch('attribution_checker._check_url', side_effect=lambda url: {'url': url}):
+        checked = dict(attribution_checker._check_urls(urls, max_workers=2))
+
+    assert sorted(checked) == sorted(f'https://example.com/{i}' for i in range(10))
+    assert all(checked[url] == {'url': url} for url in checked)
+
+def test_prefilter_urls():
+    """Test the HTTP prefilter drops map-less pages and keeps unreachable ones."""
+    pages = {
+        'https://map.example.com': ('text/html', b'<script src="https://unpkg.com/leaflet/dist/leaflet.js"></script>'),
+        'https://plain.example.com': ('text/html', b'<p>No maps here</p>'),
+        'https://image.example.com/maptiler.png': ('image/png', b'\x89PNG maptiler')
+    }
+
+    def fake_get(url, timeout, stream):
+        assert stream
+        if url not in pages:
+            raise attribution_checker.requests.ConnectionError("refused")
+        content_type, body = pages[url]
+        response = MagicMock(ok=True, headers={'Content-Type': content_type}, encoding='utf-8')
+        response.raw.read.return_value = body
+        return response
+
+    urls = ['https://map.example.com', 'https://plain.example.com', 'https://down.example.com',
+            'https://image.example.com/maptiler.png']
+    with patch('attribution_checker.requests.Session') as mock_session:
+        session = mock_session.return_value.__enter__.return_value
+        session.get.side_effect = fake_get
+        kept = set(attribution_checker._prefilter_urls(urls, max_workers=2))
+
+    assert kept == {'https://map.example.com', 'https://down.example.com'}
+    adapter = session.mount.call_args_list[0].args[1]
+    assert adapter._pool_maxsize == 2
@@ -1,13 +1,22 @@
 import pytest
+import requests
 from unittest.mock import Mock, patch
+import web_crawler
 from web_crawler import MapTilerWebCrawler
-from bs4 import BeautifulSoup
 import json
+import threading
+import time
 
 @pytest.fixture
 def crawler():
     return MapTilerWebCrawler(max_pages=10, max_depth=2, concurrency=2)
 
+def html_response(html, content_type='text/html; charset=utf-8', url='https://example.com/'):
+    """Build a mock streamed response with the given body."""
+    response = Mock(ok=True, headers={'Content-Type': content_type}, encoding='utf-8', url=url)
+    response.raw.read.return_value = html.encode('utf-8')
+    return response
+
 def test_init():
     """Test crawler initialization."""
     crawler = MapTilerWebCrawler()
@@ -15,6 +24,26 @@ def test_init():
     assert crawler.max_depth == 3
     assert crawler.concurrency == 5
     assert len(crawler.visited_urls) == 0
+    assert crawler.checker is None
+
+@patch('requests.Session.get')
+def test_crawl_url_uses_thread_checker(mock_get, crawler):
+    """Test pages are checked with the worker thread's long-lived checker."""
+    mock_get.return_value = Mock(ok=False)
+    thread_checker = Mock()
+    thread_checker.check_page.return_value = (None, [])
+
+    with patch('web_crawler.get_thread_checker', return_value=thread_checker):
+        crawler._crawl_url('https://example.com/a')
+        crawler._crawl_url('https://example.com/b')
+
+    assert thread_checker.check_page.call_count == 2
+
+def test_session_pools_connections(crawler):
+    """Test pages are fetched through one pooled session."""
+    adapter = crawler.session.get_adapter('https://example.com')
+    assert adapter._pool_maxsize == crawler.concurrency * 2
+    assert adapter.max_retries.total == 2
 
 def test_robots_parser(crawler):
     """Test robots.txt parsing."""
@@ -29,9 +58,81 @@ def test_robots_parser(crawler):
 
         # Verify the method calls
         assert result == True
-        crawler._get_robots_parser.assert_called_once_with('https://example.com')
+        crawler._get_robots_parser.assert_called_once_with('https', 'example.com')
         mock_parser.can_fetch.assert_called_once_with('*', 'https://example.com/page')
 
+def test_robots_failure_cached(crawler):
+    """Test an unreachable robots.txt is fetched once per host."""
+    with patch('requests.Session.get', side_effect=requests.ConnectionError('unreachable')) as mock_read:
+        assert crawler._can_fetch('https://example.com/a') == True
+        assert crawler._can_fetch('https://example.com/b') == True
+
+    mock_read.assert_called_once()
+
+@pytest.mark.parametrize('status_code, allowed', [(200, False), (403, False), (404, True)])
+def test_robots_fetched_through_session(crawler, status_code, allowed):
+    """Test robots.txt is fetched with the pooled session and statuses handled like urllib."""
+    robots = Mock(status_code=status_code, ok=status_code < 400,
+                  content=b'User-agent: *\nDisallow: /private')
+
+    with patch.object(crawler.session, 'get', return_value=robots) as mock_get:
+        assert crawler._can_fetch('https://example.com/private/a') == allowed
+
+    mock_get.assert_called_once_with('https://example.com/robots.txt', timeout=web_crawler._ROBOTS_TIMEOUT)
+
+def test_robots_disk_cache(tmp_path):
+    """Test parsed robots.txt files are reused by later crawlers until stale."""
+    cache_file = str(tmp_path / 'robots')
+
+    robots = Mock(status_code=200, ok=True, content=b'User-agent: *\nDisallow: /private')
+
+    with patch('requests.Session.get', return_value=robots) as mock_read:
+        first = MapTilerWebCrawler(robots_cache_file=cache_file)
+        assert first._can_fetch('https://example.com/private/a') == False
+        first.close()
+
+        second = MapTilerWebCrawler(robots_cache_file=cache_file)
+        assert second._can_fetch('https://example.com/private/b') == False
+        assert mock_read.call_count == 1
+        second.close()
+
+        with patch('web_crawler.time.time', return_value=time.time() + web_crawler._ROBOTS_TTL):
+            stale = MapTilerWebCrawler(robots_cache_file=cache_file)
+            stale._can_fetch('https://example.com/')
+            stale.close()
+        assert mock_read.call_count == 2
+
+def test_robots_disk_cache_skips_server_errors(tmp_path):
+    """Test a robots.txt fetch that failed with a 5xx is not saved for later runs."""
+    cache_file = str(tmp_path / 'robots')
+    unavailable = Mock(status_code=503, ok=False)
+    robots = Mock(status_code=200, ok=True, content=b'User-agent: *\nDisallow: /private')
+
+    with patch('requests.Session.get', side_effect=[unavailable, robots]) as mock_get:
+        first = MapTilerWebCrawler(robots_cache_file=cache_file)
+        first._can_fetch('https://example.com/a')
+        first.close()
+
+        second = MapTilerWebCrawler(robots_cache_file=cache_file)
+        assert second._can_fetch('https://example.com/a') == True
+        second.close()
+
+    assert mock_get.call_count == 2
+
+def test_wait_for_host_spaces_requests(crawler):
+    """Test requests to one host are spaced while other hosts proceed."""
+    crawler.robots_cache['slow.example.com'] = Mock(crawl_delay=Mock(return_value=2))
+
+    with patch('web_crawler.time.monotonic', return_value=100.0), \
+            patch('web_crawler.time.sleep') as mock_sleep:
+        crawler._wait_for_host('https://example.com/a')
+        crawler._wait_for_host('https://other.example.com/a')
+        crawler._wait_for_host('https://example.com/b')
+        crawler._wait_for_host('https://slow.example.com/a')
+        crawler._wait_for_host('https://slow.example.com/b')
+
+    assert [call.args[0] for call in mock_sleep.call_args_list] == [crawler.host_delay, 2]
+
 def test_extract_links(crawler):
     """Test link extraction from HTML."""
     html = """
@@ -40,6 +141,8 @@ def test_extract_links(crawler):
             <a href="https://example.com/page1">Link 1</a>
             <a href="/page2">Link 2</a>
             <a href="page3">Link 3</a>
+            <a href="//cdn.example.com/page4">Link 4</a>
+            <a href="javascript:void(0)">Link 5</a>
         </body>
     </html>
     """
@@ -49,35 +152,161 @@ def test_extract_links(crawler):
     assert 'https://example.com/page1' in links
     assert 'https://example.com/page2' in links
     assert 'https://example.com/page3' in links
+    assert 'https://cdn.example.com/page4' in links
+    assert len(links) == 4
 
-@patch('requests.get')
-@patch('web_crawler.MapTilerAttributionChecker')
-def test_crawl_url(mock_checker, mock_get, crawler):
-    """Test crawling a single URL."""
-    mock_response = Mock()
-    mock_response.ok = True
-    mock_response.text = '<html><a href="https://example.com/page2">Link</a></html>'
-    mock_get.return_value = mock_response
+def test_extract_links_normalizes_duplicates(crawler):
+    """Test fragment, host case and trailing slash variants yield one link."""
+    html = """
+    <a href="https://Example.com/a/">A</a>
+    <a href="/a#section">A again</a>
+    <a href="https://example.com/a?">A once more</a>
+    <a href="https://example.com">Home</a>
+    <a href="#top">Top</a>
+    """
+    links = crawler._extract_links('https://example.com/', html)
+
+    assert links == {'https://example.com/a', 'https://example.com/'}
+
+def test_extract_links_regex(crawler):
+    """Test the regex fast path handles attribute order, quoting and entities."""
+    html = """
+    <A class="nav" HREF='/page1'>Link 1</A>
+    <a data-x="1" href="/search?q=maps&amp;page=2">Link 2</a>
+    <a data-href="/tracking" href="/real">Link 3</a>
+    <a ng-href="/ignored">No link</a>
+    <link href="/style.css" rel="stylesheet">
+    <a name="top">No link</a>
+    """
+    links = crawler._extract_links('https://example.com', html)
 
+    assert links == {'https://example.com/page1', 'https://example.com/search?q=maps&page=2',
+                     'https://example.com/real'}
+
+def test_extract_links_parse_html(crawler):
+    """Test parse_html falls back to BeautifulSoup without lxml."""
+    crawler.parse_html = True
+    with patch('web_crawler.lxml_html', None):
+        links = crawler._extract_links('https://example.com', '<a href=/page1>Link</a>')
+
+    # Unquoted hrefs are only found by a real parser
+    assert links == {'https://example.com/page1'}
+
+def test_extract_links_with_lxml(crawler):
+    """Test lxml resolves anchors against the page's <base href>."""
+    pytest.importorskip('lxml.html')
+    html = """
+    <html><head><base href="https://cdn.example.com/docs/"><link href="style.css"></head>
+    <body><a href="page1">Link</a><img src="map.png"></body></html>
+    """
+    crawler.parse_html = True
+    links = crawler._extract_links('https://example.com', html)
+
+    assert links == {'https://cdn.example.com/docs/page1'}
+
+@patch('requests.Session.get')
+def test_crawl_url(mock_get, crawler):
+    """Test crawling a single URL."""
     mock_checker_instance = Mock()
-    mock_checker_instance.check_website.return_value = {'uses_maptiler': True}
+    mock_checker_instance.check_page.return_value = (
+        {'uses_maptiler': True},
+        ['https://example.com/page2', 'mailto:info@example.com']
+    )
     crawler.checker = mock_checker_instance
 
     links = crawler._crawl_url('https://example.com')
-    assert 'https://example.com/page2' in links
+    assert links == {'https://example.com/page2'}
     assert 'https://example.com' in crawler.visited_urls
+    assert crawler.results == [{'uses_maptiler': True}]
+    # Links come from the browser load; the page is not fetched again
+    assert [call.args[0] for call in mock_get.call_args_list] == ['https://example.com/robots.txt']
 
-@patch('requests.get')
+@patch('requests.Session.get')
+def test_crawl_url_fetches_links_after_check_error(mock_get, crawler):
+    """Test links are fetched over HTTP when the browser check failed."""
+    mock_get.return_value = html_response('<html><a href="https://example.com/page2">Link</a></html>')
+
+    crawler.checker = Mock()
+    crawler.checker.check_page.return_value = ({'error': 'timeout'}, None)
+
+    links = crawler._crawl_url('https://example.com')
+    assert 'https://example.com/page2' in links
+
+@patch('requests.Session.get')
+def test_crawl_url_resolves_fallback_links_against_final_url(mock_get, crawler):
+    """Test relative links resolve against the served URL, not the normalized one."""
+    mock_get.return_value = html_response('<a href="intro">Intro</a>', url='https://example.com/docs/')
+    crawler.checker = Mock()
+    crawler.checker.check_page.return_value = ({'error': 'timeout'}, None)
+
+    with patch.object(crawler, '_can_fetch', return_value=True):
+        links = crawler._crawl_url('https://example.com/docs')
+
+    assert links == {'https://example.com/docs/intro'}
+
+@patch('requests.Session.get')
+def test_fetch_html_skips_non_html(mock_get, crawler):
+    """Test non-HTML responses are closed without reading the body."""
+    response = html_response('%PDF-1.7', content_type='application/pdf')
+    mock_get.return_value = response
+
+    assert crawler._fetch_html('https://example.com/doc.pdf') is None
+    response.raw.read.assert_not_called()
+    response.close.assert_called_once()
+
+@patch('requests.Session.get')
+def test_fetch_html_content_type_case_insensitive(mock_get, crawler):
+    """Test the Content-Type header is matched regardless of case."""
+    mock_get.return_value = html_response('<html></html>', content_type='Text/HTML; charset=UTF-8')
+
+    assert crawler._fetch_html('https://example.com') == ('https://example.com/', '<html></html>')
+
+@patch('requests.Session.get')
+def test_fetch_html_caps_body_size(mock_get, crawler):
+    """Test the streamed body is read up to the page size cap."""
+    response = html_response('<html></html>')
+    mock_get.return_value = response
+
+    assert crawler._fetch_html('https://example.com') == ('https://example.com/', '<html></html>')
+    assert mock_get.call_args.kwargs['stream'] == True
+    response.raw.read.assert_called_once_with(web_crawler._MAX_PAGE_BYTES, decode_content=True)
+
+@patch('requests.Session.get')
 def test_crawl_respects_max_pages(mock_get, crawler):
     """Test crawler respects max_pages limit."""
-    mock_response = Mock()
-    mock_response.ok = True
-    mock_response.text = '<html><a href="https://example.com/page2">Link</a></html>'
-    mock_get.return_value = mock_response
+    # No robots.txt: every URL is allowed
+    mock_get.return_value = Mock(status_code=404, ok=False)
+    crawler.checker = Mock()
+    crawler.checker.check_page.return_value = (
+        None, [f'https://example.com/page{i}' for i in range(5)]
+    )
+    crawler.host_delay = 0
 
     crawler.max_pages = 2
     crawler.crawl(['https://example.com'])
-    assert len(crawler.visited_urls) <= 2
+    assert len(crawler.visited_urls) == 2
+    assert crawler.checker.check_page.call_count == 2
+
+@patch('requests.Session.get')
+def test_crawl_url_claims_each_url_once(mock_get, crawler):
+    """Test concurrent workers never check the same URL twice."""
+    mock_get.return_value = Mock(ok=False)
+    crawler.checker = Mock()
+    crawler.checker.check_page.return_value = (None, [])
+
+    def slow_can_fetch(url):
+        time.sleep(0.05)
+        return True
+
+    with patch.object(crawler, '_can_fetch', side_effect=slow_can_fetch):
+        threads = [threading.Thread(target=crawler._crawl_url, args=('https://example.com',))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    crawler.checker.check_page.assert_called_once_with('https://example.com')
 
 def test_save_results(crawler, tmp_path):
     """Test saving results to file."""
@@ -93,13 +322,47 @@ def test_save_results(crawler, tmp_path):
         assert data['maptiler_pages_found'] == 1
         assert len(data['results']) == 1
 
-@patch('requests.get')
+def test_stream_results(tmp_path):
+    """Test hits are streamed to the results file instead of kept in memory."""
+    results_file = tmp_path / "hits.jsonl"
+    crawler = MapTilerWebCrawler(results_file=str(results_file))
+    crawler.checker = Mock()
+    crawler.checker.check_page.return_value = ({'url': 'https://example.com', 'uses_maptiler': True}, [])
+
+    with patch.object(crawler, '_can_fetch', return_value=True):
+        crawler._crawl_url('https://example.com')
+    assert crawler.results == []
+    assert json.loads(results_file.read_text()) == {'url': 'https://example.com', 'uses_maptiler': True}
+
+    crawler.close()
+    summary_file = tmp_path / "summary.json"
+    crawler.save_results(str(summary_file))
+    summary = json.loads(summary_file.read_text())
+    assert summary['maptiler_pages_found'] == 1
+    assert summary['results_file'] == str(results_file)
+
+def test_save_results_without_orjson(crawler, tmp_path):
+    """Test results are saved with the json module when orjson is missing."""
+    crawler.results = [{'url': 'https://example.com', 'uses_maptiler': True}]
+    output_file = tmp_path / "test_results.json"
+
+    with patch('web_crawler.orjson', None):
+        crawler.save_results(str(output_file))
+
+    with open(output_file) as f:
+        assert json.load(f)['results'] == crawler.results
+
+@patch('requests.Session.get')
 def test_crawl_handles_errors(mock_get, crawler):
     """Test crawler handles network errors gracefully."""
     mock_get.side_effect = Exception("Network error")
+    crawler.checker = Mock()
+    crawler.checker.check_page.return_value = (
+        {'url': 'https://example.com/', 'error': 'net::ERR_NAME_NOT_RESOLVED'}, None
+    )
     crawler.crawl(['https://example.com'])
     assert len(crawler.results) == 0
-    assert 'https://example.com' in crawler.visited_urls
+    assert 'https://example.com/' in crawler.visited_urls
 
 def test_concurrent_crawling(crawler):
     """Test concurrent crawling functionality."""
@@ -109,5 +372,47 @@ def test_concurrent_crawling(crawler):
         crawler.crawl(test_urls)
         assert mock_crawl.call_count == 5
 
+def test_crawl_max_pages_ignores_robots_skips(crawler):
+    """Test URLs disallowed by robots.txt do not use up max_pages."""
+    crawler.max_pages = 3
+    crawler.host_delay = 0
+    crawler.checker = Mock()
+    crawler.checker.check_page.side_effect = lambda url: (None, {
+        'https://example.com/': ['https://example.com/private/a', 'https://example.com/private/b',
+                                 'https://example.com/a', 'https://example.com/b'],
+    }.get(url, []))
+
+    with patch.object(crawler, '_can_fetch', side_effect=lambda url: '/private/' not in url):
+        crawler.crawl(['https://example.com/'])
+
+    assert crawler.visited_urls == {'https://example.com/', 'https://example.com/a', 'https://example.com/b'}
+
+def test_crawl_normalizes_start_urls(crawler):
+    """Test a start URL and the page's link back to it are crawled once."""
+    with patch.object(crawler, '_crawl_url', return_value={'https://example.com/'}) as mock_crawl:
+        crawler.crawl(['https://Example.com', 'https://example.com/#top'])
+
+    mock_crawl.assert_called_once_with('https://example.com/', 0)
+
+def test_crawl_schedules_links_without_depth_barrier(crawler):
+    """Test links are crawled while a slower page of the previous depth still runs."""
+    child_crawled = threading.Event()
+
+    def crawl_url(url, depth):
+        if url == 'https://example.com/slow':
+            # Only finishes once the other page's link has been crawled
+            assert child_crawled.wait(timeout=5)
+            return set()
+        if url == 'https://example.com/fast':
+            return {'https://example.com/child'}
+        child_crawled.set()
+        return set()
+
+    with patch.object(crawler, '_crawl_url', side_effect=crawl_url) as mock_crawl:
+        crawler.crawl(['https://example.com/slow', 'https://example.com/fast'])
+
+    assert child_crawled.is_set()
+    mock_crawl.assert_any_call('https://example.com/child', 1)
+
 if __name__ == '__main__':
     pytest.main(['-v'])
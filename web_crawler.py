@@ -1,93 +1,315 @@
+import re
 import requests
-from urllib.parse import urljoin, urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from html import unescape
+from urllib.parse import urljoin, urlsplit
 from bs4 import BeautifulSoup
 import logging
-from concurrent.futures import ThreadPoolExecutor
+import shelve
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import time
 from urllib.robotparser import RobotFileParser
 import json
 from datetime import datetime
-from attribution_checker import MapTilerAttributionChecker
+from attribution_checker import ResultWriter, close_thread_checkers, get_thread_checker, normalize_url
+
+try:
+    from lxml import html as lxml_html
+except ImportError:
+    lxml_html = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_FETCH_TIMEOUT = 10
+_ROBOTS_TIMEOUT = 5
+
+# Minimum seconds between requests to one host, unless robots.txt sets a
+# Crawl-delay
+_DEFAULT_HOST_DELAY = 0.5
+
+# Only HTML responses are parsed for links, and only up to this size
+_HTML_CONTENT_TYPES = ('text/html', 'application/xhtml')
+_MAX_PAGE_BYTES = 2 * 1024 * 1024
+
+# Parsed robots.txt files kept in the on-disk cache are refetched after a day
+_ROBOTS_TTL = 24 * 60 * 60
+
+# Transient network failures are retried with a short backoff
+_FETCH_RETRIES = Retry(total=2, backoff_factor=0.3)
 
 class MapTilerWebCrawler:
-    def __init__(self, max_pages=100, max_depth=3, concurrency=5):
+    # Quoted href of an anchor start tag; anchors this misses (unquoted
+    # attributes, quotes inside the value) just contribute no links. href
+    # must follow whitespace so data-href and ng-href are not mistaken for it
+    _HREF_RE = re.compile(r'<a\s(?:[^>]*?\s)?href\s*=\s*["\']([^"\']+)["\']', re.IGNORECASE)
+
+    def __init__(self, max_pages=100, max_depth=3, concurrency=5, checker=None, parse_html=False,
+                 host_delay=_DEFAULT_HOST_DELAY, robots_cache_file=None, results_file=None):
         self.max_pages = max_pages
         self.max_depth = max_depth
         self.concurrency = concurrency
+        # Links are found with _HREF_RE unless a full HTML parse is requested
+        self.parse_html = parse_html
+        # lxml parsers must not be shared between threads
+        self._thread_local = threading.local()
         self.visited_urls = set()
+        self._visited_lock = threading.Lock()
+        # URLs released again because robots.txt disallows them; they do not
+        # count towards max_pages
+        self._robots_skipped = 0
         self.robots_cache = {}
+        # Optional on-disk cache of parsed robots.txt files, shared by runs
+        self._robots_store = shelve.open(robots_cache_file) if robots_cache_file else None
+        self._robots_store_lock = threading.Lock()
+        # Pages on different hosts are fetched in parallel; requests to the
+        # same host are spaced host_delay apart
+        self.host_delay = host_delay
+        self._next_fetch_per_host = {}
+        self._host_lock = threading.Lock()
         self.results = []
-        self.checker = MapTilerAttributionChecker()
+        # With a results file, hits are streamed to it as JSON Lines instead
+        # of being kept in self.results
+        self.results_file = results_file
+        self._result_writer = ResultWriter(results_file, 'jsonl') if results_file else None
+        self._results_written = 0
+        self._results_lock = threading.Lock()
+        # Without an explicit checker, each worker thread uses its own
+        # long-lived checker, so every driver is reused across URLs but
+        # never shared between threads.
+        self.checker = checker
+
+        # One pooled session keeps connections to each host alive across
+        # pages; workers share it, so the pool is sized to the concurrency.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency * 2,
+                              max_retries=_FETCH_RETRIES)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
 
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
 
-    def _get_robots_parser(self, base_url):
-        """Get and cache robots.txt parser for a domain."""
-        if base_url in self.robots_cache:
-            return self.robots_cache[base_url]
+    def _get_robots_parser(self, scheme, netloc):
+        """Get and cache robots.txt parser for a host."""
+        if netloc in self.robots_cache:
+            return self.robots_cache[netloc]
 
-        robots_url = urljoin(base_url, '/robots.txt')
-        rp = RobotFileParser()
-        rp.set_url(robots_url)
+        rp = self._load_robots_parser(netloc)
+        if rp is not None:
+            self.robots_cache[netloc] = rp
+            return rp
+
+        robots_url = f"{scheme}://{netloc}/robots.txt"
+        rp = RobotFileParser(robots_url)
         try:
-            rp.read()
-            self.robots_cache[base_url] = rp
+            self._read_robots(rp)
         except Exception as e:
-            self.logger.warning(f"Could not fetch robots.txt for {base_url}: {e}")
+            self.logger.warning(f"Could not fetch robots.txt for {netloc}: {e}")
+            # Remember the failure so the host's other pages skip the fetch
+            rp = None
+        else:
+            self._store_robots_parser(netloc, rp)
+        self.robots_cache[netloc] = rp
+        return rp
+
+    def _read_robots(self, rp):
+        """Fetch rp's robots.txt through the pooled session and feed it to rp.
+
+        Status codes are handled like RobotFileParser.read(): 401 and 403
+        disallow every URL, other 4xx allow every URL.
+        """
+        response = self.session.get(rp.url, timeout=_ROBOTS_TIMEOUT)
+        if response.status_code in (401, 403):
+            rp.disallow_all = True
+        elif 400 <= response.status_code < 500:
+            rp.allow_all = True
+        elif response.ok:
+            rp.parse(response.content.decode('utf-8', errors='replace').splitlines())
+
+    def _load_robots_parser(self, netloc):
+        """Return the host's parser from the on-disk cache, or None if missing or stale."""
+        if self._robots_store is None:
+            return None
+        with self._robots_store_lock:
+            entry = self._robots_store.get(netloc)
+        if entry is None:
+            return None
+        fetched_at, rp = entry
+        if time.time() - fetched_at >= _ROBOTS_TTL:
             return None
         return rp
 
+    def _store_robots_parser(self, netloc, rp):
+        """Save a freshly fetched parser to the on-disk cache.
+
+        Only parsers holding rules are saved: a parsed file, or the allow/
+        disallow-all verdict of a 4xx. An unread parser (e.g. after a 5xx)
+        refuses every URL and must not outlive the current run.
+        """
+        if self._robots_store is None:
+            return
+        if not (rp.mtime() or rp.allow_all or rp.disallow_all):
+            return
+        with self._robots_store_lock:
+            self._robots_store[netloc] = (time.time(), rp)
+
     def _can_fetch(self, url):
         """Check if we're allowed to fetch the URL according to robots.txt."""
         try:
-            base_url = f"{urlparse(url).scheme}://{urlparse(url).netloc}"
-            rp = self._get_robots_parser(base_url)
+            parts = urlsplit(url)
+            rp = self._get_robots_parser(parts.scheme, parts.netloc)
             if rp:
                 return rp.can_fetch("*", url)
             return True
         except Exception:
             return True
 
+    def _wait_for_host(self, url):
+        """Sleep until the crawl delay of url's host has passed since its last request."""
+        netloc = urlsplit(url).netloc
+        rp = self.robots_cache.get(netloc)
+        delay = rp.crawl_delay("*") if rp else None
+        if delay is None:
+            delay = self.host_delay
+
+        # Reserve the next slot under the lock, sleep outside it
+        with self._host_lock:
+            now = time.monotonic()
+            fetch_at = max(now, self._next_fetch_per_host.get(netloc, now))
+            self._next_fetch_per_host[netloc] = fetch_at + delay
+        if fetch_at > now:
+            time.sleep(fetch_at - now)
+
+    def _get_lxml_parser(self):
+        """Return this thread's reusable lxml HTML parser."""
+        parser = getattr(self._thread_local, 'lxml_parser', None)
+        if parser is None:
+            parser = lxml_html.HTMLParser(recover=True, encoding='utf-8')
+            self._thread_local.lxml_parser = parser
+        return parser
+
+    def _iter_hrefs(self, url, html):
+        """Yield the href of every anchor.
+
+        By default hrefs are matched with _HREF_RE. With parse_html the page
+        is parsed with lxml, which also resolves the hrefs against url and
+        any <base href>, or with BeautifulSoup's html.parser when lxml is not
+        installed.
+        """
+        if not self.parse_html:
+            for match in self._HREF_RE.finditer(html):
+                href = match.group(1)
+                yield unescape(href) if '&' in href else href
+        elif lxml_html is not None:
+            if not html.strip():
+                return
+            tree = lxml_html.fromstring(html.encode('utf-8'), parser=self._get_lxml_parser())
+            tree.make_links_absolute(url, resolve_base_href=True)
+            for element, attribute, link, _ in tree.iterlinks():
+                if attribute == 'href' and element.tag == 'a':
+                    yield link
+        else:
+            for link in BeautifulSoup(html, 'html.parser').find_all('a', href=True):
+                yield link['href']
+
     def _extract_links(self, url, html):
         """Extract links from HTML content."""
         links = set()
         try:
-            soup = BeautifulSoup(html, 'html.parser')
-            for link in soup.find_all('a', href=True):
-                href = link['href']
-                absolute_url = urljoin(url, href)
-                if absolute_url.startswith(('http://', 'https://')):
-                    links.add(absolute_url)
+            scheme = urlsplit(url).scheme
+            for href in self._iter_hrefs(url, html):
+                # Absolute and scheme-relative hrefs need no urljoin, which
+                # would re-split the base URL for every link
+                if href.startswith(('http://', 'https://')):
+                    absolute_url = href
+                elif href.startswith('//'):
+                    absolute_url = f"{scheme}:{href}"
+                else:
+                    absolute_url = urljoin(url, href)
+                    if not absolute_url.startswith(('http://', 'https://')):
+                        continue
+                links.add(normalize_url(absolute_url))
         except Exception as e:
             self.logger.error(f"Error extracting links from {url}: {e}")
         return links
 
+    def _fetch_html(self, url):
+        """Fetch url and return (final_url, html), or None for failed and non-HTML responses.
+
+        final_url is the address after redirects; bodies are truncated at _MAX_PAGE_BYTES.
+        """
+        response = self.session.get(url, timeout=_FETCH_TIMEOUT, stream=True)
+        try:
+            if not response.ok:
+                return None
+            # Media types are case-insensitive
+            content_type = response.headers.get('Content-Type', '').lower()
+            if not content_type.startswith(_HTML_CONTENT_TYPES):
+                self.logger.debug(f"Skipping links of {url} ({content_type or 'no content type'})")
+                return None
+            body = response.raw.read(_MAX_PAGE_BYTES, decode_content=True)
+            return response.url, body.decode(response.encoding or 'utf-8', errors='replace')
+        finally:
+            response.close()
+
+    def _record_result(self, result):
+        """Keep a MapTiler hit, writing it to the results file if there is one."""
+        if self._result_writer is None:
+            self.results.append(result)
+            return
+        with self._results_lock:
+            self._result_writer.write(result)
+            self._results_written += 1
+
     def _crawl_url(self, url, depth=0):
         """Crawl a single URL and check for MapTiler usage."""
-        if depth > self.max_depth or url in self.visited_urls:
+        if depth > self.max_depth:
             return set()
 
+        # Claim the URL atomically so concurrent workers never fetch it twice
+        with self._visited_lock:
+            if url in self.visited_urls:
+                return set()
+            self.visited_urls.add(url)
+
         if not self._can_fetch(url):
             self.logger.info(f"Skipping {url} (robots.txt)")
+            with self._visited_lock:
+                self.visited_urls.discard(url)
+                self._robots_skipped += 1
             return set()
 
-        self.visited_urls.add(url)
         self.logger.info(f"Crawling {url} (depth {depth})")
+        self._wait_for_host(url)
 
         try:
             # Check for MapTiler usage
-            result = self.checker.check_website(url)
+            checker = self.checker or get_thread_checker()
+            result, links = checker.check_page(url)
             if result and result.get('uses_maptiler'):
-                self.results.append(result)
+                self._record_result(result)
                 self.logger.info(f"Found MapTiler usage on {url}")
 
-            # Get links for further crawling
-            response = requests.get(url, timeout=10)
-            if not response.ok:
+            # Links come from the same browser load; the page is only
+            # fetched again when the browser failed to load it
+            if links is not None:
+                return {normalize_url(link) for link in links
+                        if link.startswith(('http://', 'https://'))}
+
+            page = self._fetch_html(url)
+            if page is None:
                 return set()
 
-            return self._extract_links(url, response.text)
+            # url is normalized (no trailing slash), so relative links are
+            # resolved against the address that was actually served
+            final_url, html = page
+            return self._extract_links(final_url, html)
 
         except Exception as e:
             self.logger.error(f"Error crawling {url}: {e}")
@@ -98,34 +320,61 @@ class MapTilerWebCrawler:
         if isinstance(start_urls, str):
             start_urls = [start_urls]
 
-        urls_to_crawl = set(start_urls)
-        current_depth = 0
+        scheduled = set()
+        # Links waiting for a page slot, in discovery order. A URL skipped
+        # for robots.txt gives its slot back, so links are kept until the
+        # crawl is over rather than dropped once max_pages are scheduled.
+        backlog = deque()
+        self._robots_skipped = 0
 
-        while urls_to_crawl and len(self.visited_urls) < self.max_pages and current_depth <= self.max_depth:
-            new_urls = set()
+        def has_slot():
+            return len(scheduled) - self._robots_skipped < self.max_pages
 
-            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
-                # Submit crawling tasks
-                future_to_url = {
-                    executor.submit(self._crawl_url, url, current_depth): url
-                    for url in urls_to_crawl
-                }
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            pending = {}
 
-                # Process results and collect new URLs
-                for future in future_to_url:
+            def schedule(url, depth):
+                scheduled.add(url)
+                pending[executor.submit(self._crawl_url, url, depth)] = (url, depth)
+
+            # Normalized like discovered links, so a page linking back to a
+            # start URL does not load it again
+            for url in dict.fromkeys(map(normalize_url, start_urls)):
+                schedule(url, 0)
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url, depth = pending.pop(future)
                     try:
-                        new_urls.update(future.result())
+                        new_urls = future.result()
                     except Exception as e:
-                        self.logger.error(f"Error processing {future_to_url[future]}: {e}")
+                        self.logger.error(f"Error processing {url}: {e}")
+                        continue
 
-            urls_to_crawl = new_urls - self.visited_urls
-            current_depth += 1
+                    if depth < self.max_depth:
+                        backlog.extend((new_url, depth + 1) for new_url in new_urls)
 
-            # Rate limiting
-            time.sleep(1)
+                while backlog and has_slot():
+                    new_url, new_depth = backlog.popleft()
+                    if new_url not in scheduled:
+                        schedule(new_url, new_depth)
+
+    def close(self):
+        """Close the HTTP session and the robots.txt cache and results files."""
+        self.session.close()
+        if self._robots_store is not None:
+            self._robots_store.close()
+            self._robots_store = None
+        if self._result_writer is not None:
+            self._result_writer.close()
 
     def save_results(self, output_file=None):
-        """Save crawling results to a file."""
+        """Save crawling results to a file.
+
+        Results already streamed to the results file are only counted in the
+        summary, which then names that file.
+        """
         if not output_file:
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
             output_file = f'maptiler_crawl_results_{timestamp}.json'
@@ -133,12 +382,19 @@ class MapTilerWebCrawler:
         results_data = {
             'timestamp': datetime.now().isoformat(),
             'total_pages_crawled': len(self.visited_urls),
-            'maptiler_pages_found': len(self.results),
+            'maptiler_pages_found': len(self.results) + self._results_written,
             'results': self.results
         }
+        if self.results_file:
+            results_data['results_file'] = self.results_file
 
-        with open(output_file, 'w') as f:
-            json.dump(results_data, f, indent=2)
+        if orjson is not None:
+            # Serialized in C straight to bytes, in one write
+            with open(output_file, 'wb') as f:
+                f.write(orjson.dumps(results_data, option=orjson.OPT_INDENT_2))
+        else:
+            with open(output_file, 'w') as f:
+                json.dump(results_data, f, indent=2)
 
         self.logger.info(f"Results saved to {output_file}")
         return output_file
@@ -152,6 +408,14 @@ def main():
     parser.add_argument('--max-depth', type=int, default=3, help='Maximum crawl depth')
     parser.add_argument('--concurrency', type=int, default=5, help='Number of concurrent crawlers')
     parser.add_argument('--output', type=str, help='Output file path')
+    parser.add_argument('--delay', type=float, default=_DEFAULT_HOST_DELAY,
+                        help='Seconds between requests to the same host')
+    parser.add_argument('--robots-cache', type=str,
+                        help='File for caching robots.txt between runs')
+    parser.add_argument('--stream-results', type=str,
+                        help='JSON Lines file that each MapTiler hit is written to as it is found')
+    parser.add_argument('--parse-html', action='store_true',
+                        help='Extract links with an HTML parser instead of a regular expression')
     args = parser.parse_args()
 
     if not args.urls and not args.url:
@@ -167,10 +431,18 @@ def main():
     crawler = MapTilerWebCrawler(
         max_pages=args.max_pages,
         max_depth=args.max_depth,
-        concurrency=args.concurrency
+        concurrency=args.concurrency,
+        parse_html=args.parse_html,
+        host_delay=args.delay,
+        robots_cache_file=args.robots_cache,
+        results_file=args.stream_results
     )
 
-    crawler.crawl(start_urls)
+    try:
+        crawler.crawl(start_urls)
+    finally:
+        crawler.close()
+        close_thread_checkers()
     output_file = crawler.save_results(args.output)
     print(f"\nCrawling complete. Results saved to {output_file}")
 